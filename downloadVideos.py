@@ -13,50 +13,50 @@ Apple Silicon GPUやWindows環境のGPUを活用して高速にエンコード
 - Apple Silicon GPU（VideoToolbox）やWindows NVENCによるハードウェアエンコード
 - 自動品質設定（解像度に基づく最適なビットレート）
 """
-# 出力先ディレクトリ
-CURRENT_HOME = str(Path.home())
-VIDEO_FILE_PATH = os.path.join(CURRENT_HOME, 'Videos', 'MusicVideos')  # 動画の保存先
-AUDIO_FILE_PATH = os.path.join(CURRENT_HOME, 'Music', 'Downloaded')    # 音声の保存先
+from types import MappingProxyType
 
 # 動画・音声フォーマット設定
 FORMAT_SETTINGS = {
     'mp4': {
         'format': 'bestvideo[ext=mp4][dynamic_range=HDR]+bestaudio[ext=m4a]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
         'merge_output_format': 'mp4',
-        'postprocessor_args': [
+        'postprocessor_args': (
             '-c:v', 'copy',
             '-c:a', 'aac',
             '-movflags', '+use_metadata_tags',
             '-map_metadata', '0',
-        ]
+        )
     },
     'webm': {
         'format': 'bestvideo[ext=webm][dynamic_range=HDR]+bestaudio[ext=webm]/bestvideo[ext=webm]+bestaudio[ext=webm]/best[ext=webm]/best',
         'merge_output_format': 'webm',
-        'postprocessor_args': [
+        'postprocessor_args': (
             '-c:v', 'copy',
             '-c:a', 'libvorbis',
-        ]
+        )
     },
     'mkv': {
         'format': 'bestvideo[dynamic_range=HDR]+bestaudio/bestvideo+bestaudio/best',
         'merge_output_format': 'mkv',
-        'postprocessor_args': [
+        'postprocessor_args': (
             '-c:v', 'copy',
             '-c:a', 'copy',
-        ]
+        )
     },
     'mov': {
         'format': 'bestvideo[ext=mp4][dynamic_range=HDR]+bestaudio[ext=m4a]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
         'merge_output_format': 'mov',
-        'postprocessor_args': [
+        'postprocessor_args': (
             '-c:v', 'copy',
             '-c:a', 'aac',
             '-movflags', '+use_metadata_tags',
             '-map_metadata', '0',
-        ]
+        )
     }
 }
+# 共有テーブルなので読み取り専用ビューにして呼び出し側の変更から守る
+FORMAT_SETTINGS = {fmt: MappingProxyType(config)
+                   for fmt, config in FORMAT_SETTINGS.items()}
 
 def print_error(msg, exc=None):
     """
@@ -85,115 +85,417 @@ Apple Silicon GPUを使用して高速にエンコードします。
 """
 
 import yt_dlp
+import bisect
+import collections
+import concurrent.futures
+import functools
+import json
 import os
+import shutil
 import subprocess
+import threading
+import time
 from pathlib import Path
 
+# 出力先ディレクトリ
+# Path.home()のpwd参照は一度だけにし、結合はPathの__truediv__で行う
+HOME = Path.home()
+VIDEO_FILE_PATH = str(HOME / 'Videos' / 'MusicVideos')  # 動画の保存先
+AUDIO_FILE_PATH = str(HOME / 'Music' / 'Downloaded')    # 音声の保存先
+
+# ffmpeg後処理（エンコード）の同時実行スロット数
+# VideoToolboxやNVENCのメディアエンジンは専用ブロックのため、1〜2並列が最適
+_MAX_CONCURRENT_FFMPEG = 2
+
+# ダウンロード（ネットワーク待ち）とffmpeg後処理（CPU/GPU）のパイプライン制御。
+# 各URLはダウンロードスレッド上でそのまま後処理に入るが、このセマフォが
+# ffmpegをスロット数までに絞るため、待たされたスレッドがエンコード中でも
+# 他のスレッドは次のURLのダウンロードを進められる（生産者/消費者の重ね合わせ）
+_PP_SEMAPHORE = threading.Semaphore(_MAX_CONCURRENT_FFMPEG)
+
+# YoutubeDLインスタンスのスレッドごとのキャッシュ。
+# 生成のたびにエクストラクタの初期化とHTTPセッションの張り直し
+# （TLSハンドシェイクで1本あたり100〜300ms）が走るため、同一設定なら
+# 使い回してコネクションとエクストラクタキャッシュを維持する。
+# YoutubeDLはスレッドセーフではないのでキャッシュはthreading.localに置く
+_YDL_LOCAL = threading.local()
+
+
+def _get_ydl(ydl_opts, cache_key):
+    """
+    設定に対応するYoutubeDLインスタンスを取得（スレッドごとに再利用）
+    Args:
+        ydl_opts (dict): YoutubeDLへ渡すオプション
+        cache_key (tuple): 再利用可否を判定するキー
+    Returns:
+        yt_dlp.YoutubeDL: キャッシュ済みまたは新規のインスタンス
+    """
+    cache = getattr(_YDL_LOCAL, 'instances', None)
+    if cache is None:
+        cache = _YDL_LOCAL.instances = {}
+    ydl = cache.get(cache_key)
+    if ydl is None:
+        ydl = cache[cache_key] = yt_dlp.YoutubeDL(ydl_opts)
+    return ydl
+
+# このスレッドが保持中の後処理スロット数。yt-dlpはポストプロセッサーが
+# 例外を投げると'finished'フックを呼ばないため、フックの対だけに頼ると
+# 失敗のたびにスロットが漏れる。フックは呼び出し元のダウンロードスレッド上で
+# 実行されるので、保持数をthreading.localで数えておき、
+# download_video側のfinallyで取り残された分を返却する
+_PP_LOCAL = threading.local()
+
+def _limit_postprocessing(d):
+    """
+    yt-dlpのポストプロセッサーフック
+    ffmpegの同時実行数をセマフォで制限し、メディアエンジンの取り合いを防ぐ
+    """
+    if d.get('status') == 'started':
+        _PP_SEMAPHORE.acquire()
+        _PP_LOCAL.held = getattr(_PP_LOCAL, 'held', 0) + 1
+    elif d.get('status') == 'finished':
+        _PP_LOCAL.held = getattr(_PP_LOCAL, 'held', 0) - 1
+        _PP_SEMAPHORE.release()
+
+def _release_leaked_pp_slots():
+    """
+    後処理の失敗で解放されなかったセマフォスロットを返却する
+    （正常終了時は保持数が0なので何もしない）
+    """
+    held = getattr(_PP_LOCAL, 'held', 0)
+    _PP_LOCAL.held = 0
+    for _ in range(held):
+        _PP_SEMAPHORE.release()
+
+_last_progress_time = 0.0
+
+def _print_progress(d):
+    """
+    yt-dlpの進捗フック
+    フレームごとではなく約1秒間隔に間引いて進捗を表示する
+    """
+    global _last_progress_time
+    if d.get('status') == 'finished':
+        print(f"\rダウンロード完了、後処理中: {os.path.basename(d.get('filename', ''))}")
+        return
+    if d.get('status') != 'downloading':
+        return
+    now = time.monotonic()
+    if now - _last_progress_time < 1.0:
+        return
+    _last_progress_time = now
+    percent = d.get('_percent_str', '').strip()
+    speed = d.get('_speed_str', '').strip()
+    eta = d.get('_eta_str', '').strip()
+    print(f"\r進捗: {percent}  速度: {speed}  残り: {eta}", end='', flush=True)
+
+@functools.lru_cache(maxsize=1)
 def detect_ffmpeg():
     """
     システムからFFmpegの実行ファイルのパスを検出
+
+    結果はプロセス内でキャッシュされるため、検出処理は初回呼び出し時のみ実行されます。
     Returns:
         str or None: FFmpegのパス。見つからない場合はNone
     """
-    if os.name == 'nt':
-        result = subprocess.run(['where', 'ffmpeg'], capture_output=True, text=True)
-    else:
-        result = subprocess.run(['which', 'ffmpeg'], capture_output=True, text=True)
-    if result.returncode == 0:
-        return result.stdout.strip().split('\n')[0]
-    # 一般的なインストール場所を順番にチェック
-    common_paths = [
-        '/usr/bin/ffmpeg',
-        '/usr/local/bin/ffmpeg',
+    # shutil.whichはサブプロセスを起動せずにPATHを探索する（Windowsの.exeにも対応）
+    path = shutil.which('ffmpeg')
+    if path:
+        return path
+    # 一般的なインストール場所を順番にチェック（statを直接試みる）
+    common_paths = (
         '/opt/homebrew/bin/ffmpeg',
+        '/usr/local/bin/ffmpeg',
+        '/usr/bin/ffmpeg',
         '/opt/local/bin/ffmpeg'
-    ]
+    )
     for path in common_paths:
-        if os.path.exists(path):
+        try:
+            os.stat(path)
             return path
+        except OSError:
+            pass
     return None
 
 
-os.makedirs(VIDEO_FILE_PATH, exist_ok=True)
-os.makedirs(AUDIO_FILE_PATH, exist_ok=True)
+# 作成済みの出力先ディレクトリ（同じパスへのmakedirsを繰り返さないための記録）
+_created_dirs = set()
+_created_dirs_lock = threading.Lock()
+
+def _ensure_output_dir(path):
+    """
+    出力先ディレクトリを作成（同じパスは一度だけ）
+    Args:
+        path (str): 出力先ディレクトリのパス
+    """
+    with _created_dirs_lock:
+        if path not in _created_dirs:
+            os.makedirs(path, exist_ok=True)
+            _created_dirs.add(path)
+
+# 解像度（高さ）からビットレートを推定するためのテーブル
+# _HEIGHTSの区間に対応する値を_BITRATESから引く（bisectで二分探索）
+# 新しい段（8Kなど）は両タプルに1要素ずつ足すだけで追加できる
+_HEIGHTS = (720, 1080, 1440, 2160)            # SD / HD / FullHD / 2K / 4K の境界
+_BITRATES = (2500, 5000, 8000, 25000, 45000)  # kbps
+
+def _estimate_bitrate(format_info):
+    """
+    フォーマット情報からビットレートを取得または推定（kbps）
+    -q:v非対応の古いffmpegビルド向けフォールバック用
+    Args:
+        format_info (dict): 動画フォーマット情報
+    Returns:
+        int: ビットレート（kbps）
+    """
+    vbr = format_info.get('vbr', 0) or format_info.get('tbr', 0)
+    if vbr:
+        return int(vbr)
+    # ビットレートが不明な場合は解像度から最適な値を推定
+    height = format_info.get('height', 0)
+    return _BITRATES[bisect.bisect_right(_HEIGHTS, height)]
 
-def get_video_quality_settings(format_info):
+def get_video_quality_settings(format_info, q=50):
     """
     動画の品質設定（FFmpegオプション）を取得
     Args:
         format_info (dict): 動画フォーマット情報
+        q (int or None): -q:vの品質値（1-100、高いほど高品質）。
+            Noneの場合はビットレート指定にフォールバック
     Returns:
         list: FFmpegのエンコード設定オプション
     """
-    # ビットレートの取得または推定（kbps）
-    vbr = format_info.get('vbr', 0) or format_info.get('tbr', 0)
-    if not vbr:
-        # ビットレートが不明な場合は解像度から最適な値を推定
-        height = format_info.get('height', 0)
-        if height >= 2160:      # 4K
-            vbr = 45000         # 45Mbps
-        elif height >= 1440:    # 2K
-            vbr = 25000         # 25Mbps
-        elif height >= 1080:    # Full HD
-            vbr = 8000          # 8Mbps
-        elif height >= 720:     # HD
-            vbr = 5000          # 5Mbps
-        else:                   # SD
-            vbr = 2500          # 2.5Mbps
-    
-    # ビットレートをbps単位に変換
-    bitrate = str(int(vbr * 1000))
-    
+    if os.name == 'nt':
+        # Windows/NVENC: デコードもCUDAで行い、フレームをGPUメモリに
+        # 常駐させたままNVENCへ渡す（-pix_fmtを指定するとhwdownload/
+        # hwuploadの暗黙挿入で全フレームがCPU⇔GPUをコピーされるため指定しない）
+        return [
+            # 入力オプション（デコード設定）
+            '-hwaccel', 'cuda',                  # CUDAでハードウェアデコード
+            '-hwaccel_output_format', 'cuda',    # フレームをGPUメモリに保持
+
+            # 出力オプション（エンコード設定）
+            '-c:v', 'h264_nvenc',                # NVIDIA GPUエンコーダー
+            '-b:v', str(_estimate_bitrate(format_info) * 1000),
+            '-profile:v', 'high',                # H.264 Highプロファイル（高品質）
+
+            # 音声設定
+            '-c:a', 'aac',                       # AACコーデック
+            '-b:a', '320k',                      # 音声ビットレート（320kbps）
+
+            # その他の設定
+            '-movflags', '+faststart+empty_moov+delay_moov'
+        ]
+
+    if q is not None:
+        # 最近のVideoToolboxは-q:vを品質ターゲット（CRF相当）として扱い、
+        # -b:vと併用すると-b:vを無視するため、品質指定のみ渡す
+        # （フレームごとにエンコーダーがビットレートを適応的に選択する）
+        rate_args = ['-q:v', str(q)]
+    else:
+        # -q:v非対応のビルド向け：推定ビットレートをbps単位で指定
+        rate_args = ['-b:v', str(_estimate_bitrate(format_info) * 1000)]
+
+    # HDR/10bitソースの判定
+    is_hdr = (str(format_info.get('dynamic_range', '')).startswith('HDR')
+              or int(format_info.get('bit_depth') or 8) > 8)
+    if is_hdr:
+        # H.264は10bit非対応のためHEVC（main10）+p010leに切り替える。
+        # nv12のままだとVTに渡す前にCPUで10→8bitの変換が全フレームに走る
+        codec_args = [
+            '-c:v', 'hevc_videotoolbox',     # VideoToolboxでHEVCエンコード
+            '-profile:v', 'main10',          # 10bitプロファイル
+            '-pix_fmt', 'p010le',            # VTネイティブの10bitフォーマット
+            '-tag:v', 'hvc1',                # Appleデバイス互換のタグ
+        ]
+    else:
+        codec_args = [
+            '-c:v', 'h264_videotoolbox',     # VideoToolboxでH.264エンコード
+            '-profile:v', 'high',            # H.264 Highプロファイル（高品質）
+            '-level', '4.2',                 # H.264レベル（互換性）
+            '-pix_fmt', 'nv12',              # VideoToolbox最適化ピクセルフォーマット
+        ]
+
     # Apple Silicon GPU用の最適化された設定
+    # デコードはソフトウェアのまま（M系チップではH.264/H.265のVTデコードは
+    # ソフトウェアデコードより遅いため、エンコード側のみVTを使う）
     return [
-        # 入力オプション（デコード設定）
-        '-hwaccel', 'videotoolbox',          # VideoToolboxでハードウェアデコード
-        '-hwaccel_output_format', 'videotoolbox_vld',  # GPUメモリを使用
-        
         # 出力オプション（エンコード設定）
-        '-c:v', 'h264_videotoolbox',         # VideoToolboxでH.264エンコード
-        '-b:v', bitrate,                     # 動画ビットレート
+        *codec_args,                         # コーデック・プロファイル設定
+        '-realtime', '0',                    # リアルタイム性より品質を優先
+        *rate_args,                          # 品質またはビットレート指定
         '-allow_sw', '0',                    # ハードウェアエンコードを強制
-        '-profile:v', 'high',                # H.264 Highプロファイル（高品質）
-        '-level', '4.2',                     # H.264レベル（互換性）
-        '-q:v', '35',                        # 品質設定（0-100、低いほど高品質）
-        '-pix_fmt', 'nv12',                  # VideoToolbox最適化ピクセルフォーマット
-        
+        # VTエンコードではCPU側はフレーム転送とmuxが主な仕事のため、
+        # スレッドを張りすぎると効率コアとのコンテキストスイッチで損をする
+        '-threads', str(max(2, (os.cpu_count() or 2) // 2)),
+
         # 音声設定
         '-c:a', 'aac',                       # AACコーデック
         '-b:a', '320k',                      # 音声ビットレート（320kbps）
-        
+
         # その他の設定
-        '-movflags', '+faststart'            # Web再生用の最適化
+        # empty_moov+delay_moovで断片化出力にし、エンコード後にファイル全体を
+        # 読み書きし直すfaststartのmoov移動パスを不要にする
+        '-movflags', '+faststart+empty_moov+delay_moov'
     ]
 
+def _scan_encoders(ffmpeg_path, encoders):
+    """
+    複数エンコーダーの有無を1回の-encoders走査でまとめて確認
+
+    一覧を1行ずつ走査し、すべて見つかった時点でffmpegを打ち切るため、
+    15KB程度ある全出力をバッファリングせずに済みます。
+    Args:
+        ffmpeg_path (str): FFmpegのパス
+        encoders (tuple): エンコーダー名のタプル（例: ('h264_videotoolbox',)）
+    Returns:
+        set: 利用可能だったエンコーダー名の集合
+    """
+    # バイト列のまま照合し、UTF-8デコードとstr生成のコストを省く
+    remaining = {encoder.encode(): encoder for encoder in encoders}
+    found = set()
+    # close_fds=False: プローブにfd隔離は不要で、ulimitが大きい環境では
+    # 全fdのcloseがspawnコストの大半を占めるため省く
+    proc = subprocess.Popen(
+        [ffmpeg_path, '-hide_banner', '-encoders'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        close_fds=False)
+    for line in proc.stdout:
+        for raw in tuple(remaining):
+            if raw in line:
+                found.add(remaining.pop(raw))
+        if not remaining:
+            proc.terminate()
+            break
+    proc.stdout.close()
+    proc.wait()
+    return found
+
+# GPUエンコード関連の機能一覧
+GpuCaps = collections.namedtuple('GpuCaps', 'nvenc cuda videotoolbox h264_vt hevc_vt')
+
+@functools.lru_cache(maxsize=1)
+def get_gpu_caps(ffmpeg_path):
+    """
+    GPUエンコード関連の機能をまとめてプローブ
+
+    -hwaccelsを1回、（アクセラレーターが見つかった場合のみ）-encodersを
+    1回走査するだけで全機能を収集し、結果をキャッシュします。
+    Args:
+        ffmpeg_path (str): FFmpegのパス
+    Returns:
+        GpuCaps: 各機能の利用可否
+    """
+    try:
+        hwaccels_result = subprocess.run(
+            [ffmpeg_path, '-hide_banner', '-hwaccels'],
+            capture_output=True, close_fds=False)
+    except OSError:
+        return GpuCaps(False, False, False, False, False)
+    # バイト列のまま照合（部分一致の判定にデコードは不要）
+    has_cuda = b'cuda' in hwaccels_result.stdout
+    has_videotoolbox = b'videotoolbox' in hwaccels_result.stdout
+    if os.name == 'nt':
+        wanted = ('h264_nvenc',) if has_cuda else ()
+    else:
+        wanted = ('h264_videotoolbox', 'hevc_videotoolbox') if has_videotoolbox else ()
+    found = _scan_encoders(ffmpeg_path, wanted) if wanted else set()
+    return GpuCaps(
+        nvenc='h264_nvenc' in found,
+        cuda=has_cuda,
+        videotoolbox=has_videotoolbox,
+        h264_vt='h264_videotoolbox' in found,
+        hevc_vt='hevc_videotoolbox' in found,
+    )
+
+# GPU判定結果の永続キャッシュ（yt-dlpのinfoキャッシュと同様の仕組み）
+# ffmpegバイナリのパスとmtimeが一致する限りプローブをスキップできる
+_GPU_CACHE_FILE = HOME / '.cache' / 'downloadvideos' / 'gpu_support.json'
+
+def _read_gpu_cache(ffmpeg_path, ffmpeg_mtime):
+    """
+    前回のGPU判定結果をキャッシュファイルから読む
+    Args:
+        ffmpeg_path (str): FFmpegのパス
+        ffmpeg_mtime (float): FFmpegバイナリのmtime
+    Returns:
+        bool or None: キャッシュが有効なら判定結果、無効ならNone
+    """
+    try:
+        with open(_GPU_CACHE_FILE, encoding='utf-8') as f:
+            cache = json.load(f)
+        if (cache.get('ffmpeg_path') == ffmpeg_path
+                and cache.get('ffmpeg_mtime') == ffmpeg_mtime):
+            return bool(cache['has_gpu'])
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def _write_gpu_cache(ffmpeg_path, ffmpeg_mtime, has_gpu):
+    """
+    GPU判定結果をキャッシュファイルへ保存（失敗しても無視）
+    """
+    try:
+        _GPU_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(_GPU_CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                'ffmpeg_path': ffmpeg_path,
+                'ffmpeg_mtime': ffmpeg_mtime,
+                'has_gpu': has_gpu,
+            }, f)
+    except OSError:
+        pass
+
+@functools.lru_cache(maxsize=1)
 def check_gpu_support(ffmpeg_path):
     """
     GPUエンコードのサポート状況を確認
+
+    結果はプロセス内（lru_cache）とキャッシュファイルの両方に保持されます。
+    ffmpegバイナリが同じ（パスとmtimeが一致）なら次回起動時はプローブを
+    省略し、statとJSON読み込みだけで済みます。
+    Args:
+        ffmpeg_path (str): FFmpegのパス
+    Returns:
+        bool: GPUエンコードが利用可能な場合はTrue
+    """
+    try:
+        ffmpeg_mtime = os.stat(ffmpeg_path).st_mtime
+    except OSError:
+        ffmpeg_mtime = None
+    if ffmpeg_mtime is not None:
+        cached = _read_gpu_cache(ffmpeg_path, ffmpeg_mtime)
+        if cached is not None:
+            return cached
+    has_gpu = _probe_gpu_support(ffmpeg_path)
+    if ffmpeg_mtime is not None:
+        _write_gpu_cache(ffmpeg_path, ffmpeg_mtime, has_gpu)
+    return has_gpu
+
+def _probe_gpu_support(ffmpeg_path):
+    """
+    ffmpegのサブプロセスを起動してGPUエンコードの可否を実際に調べる
+
+    まず出力の小さい-hwaccelsだけを実行し、ハードウェアアクセラレーションが
+    見つかった場合のみ-encodersでエンコーダーの有無を確認します。
     Args:
         ffmpeg_path (str): FFmpegのパス
     Returns:
         bool: GPUエンコードが利用可能な場合はTrue
     """
     try:
-        version_result = subprocess.run([ffmpeg_path, '-version'], capture_output=True, text=True)
-        encoders_result = subprocess.run([ffmpeg_path, '-encoders'], capture_output=True, text=True)
-        hwaccels_result = subprocess.run([ffmpeg_path, '-hwaccels'], capture_output=True, text=True)
+        caps = get_gpu_caps(ffmpeg_path)
         if os.name == 'nt':
-            has_nvenc = 'h264_nvenc' in encoders_result.stdout
-            has_cuda = 'cuda' in hwaccels_result.stdout
-            if has_nvenc and has_cuda:
+            if caps.cuda and caps.nvenc:
                 print("\nGPUエンコード機能:")
-                print(f"- NVIDIA NVENC: {'利用可能' if has_nvenc else '利用不可'}")
-                print(f"- CUDA: {'利用可能' if has_cuda else '利用不可'}")
+                print(f"- NVIDIA NVENC: {'利用可能' if caps.nvenc else '利用不可'}")
+                print(f"- CUDA: {'利用可能' if caps.cuda else '利用不可'}")
                 return True
         else:
-            has_videotoolbox = 'videotoolbox' in hwaccels_result.stdout
-            has_h264_videotoolbox = 'h264_videotoolbox' in encoders_result.stdout
-            if has_videotoolbox and has_h264_videotoolbox:
+            if caps.videotoolbox and caps.h264_vt:
                 print("\nGPUエンコード機能:")
-                print(f"- VideoToolbox: {'利用可能' if has_videotoolbox else '利用不可'}")
-                print(f"- H.264 VideoToolbox: {'利用可能' if has_h264_videotoolbox else '利用不可'}")
+                print(f"- VideoToolbox: {'利用可能' if caps.videotoolbox else '利用不可'}")
+                print(f"- H.264 VideoToolbox: {'利用可能' if caps.h264_vt else '利用不可'}")
                 return True
         return False
     except Exception as e:
@@ -218,77 +520,98 @@ def download_video(url, output_path, download_type, video_format='mp4', ffmpeg_p
     if not ffmpeg_path:
         print_error("FFmpegが見つかりません。")
         return False
+    _ensure_output_dir(output_path)
     format_config = FORMAT_SETTINGS.get(video_format, FORMAT_SETTINGS['mp4'])
     ydl_opts = {
         'outtmpl': f'{output_path}/%(title)s.%(ext)s',
         'prefer_ffmpeg': True,
         'ffmpeg_location': ffmpeg_path,
         'restrictfilenames': False,
-        'verbose': True,
+        'verbose': False,
+        'noprogress': True,
+        'progress_hooks': [_print_progress],
+        'concurrent_fragment_downloads': 4,
+        # 大きめのチャンク・書き込みバッファで細切れ書き込みを防ぐ
+        'http_chunk_size': 10 * 1024 * 1024,  # 10 MiB
+        'buffersize': 65536,                  # 64 KiB
+        'postprocessor_hooks': [_limit_postprocessing],
+        # -loglevel debugはフレームごとにstderrへ書き込みエンコードを遅くするため使わない
         'postprocessor_args': [
-            '-loglevel', 'debug',
-            '-stats',
+            '-loglevel', 'error',
         ],
         'extractor_args': {
             'generic': ['impersonate=chrome']
         }
     }
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
         if download_type == 'audio':
             print("\n音声をダウンロードします...")
+            # AAC（m4a）の配信を優先して選ぶ。ソースが既にAACなら
+            # FFmpegExtractAudioは再エンコードせずストリームコピーで済む
             ydl_opts.update({
-                'format': 'bestaudio/best',
+                'format': 'bestaudio[ext=m4a][acodec^=mp4a]/bestaudio/best',
                 'postprocessors': [{
                     'key': 'FFmpegExtractAudio',
                     'preferredcodec': 'm4a',
                     'preferredquality': '0',
                 }],
                 'postprocessor_args': [
-                    '-c:a', 'aac',
-                    '-b:a', '0',
                     '-vn',
+                    '-map_metadata', '0',
+                    '-movflags', '+use_metadata_tags',
                     '-y',
                     '-loglevel', 'error'
                 ],
                 'keepvideo': False,
                 'writethumbnail': False,
-                'verbose': False,
-                'embed_metadata': True,
-                'embed_thumbnail': True,
-                'add_metadata': True
+                'verbose': False
             })
         elif download_type in ['video', 'both']:
             print(f"\n動画をダウンロードします（{video_format.upper()}形式）...")
+            # フォーマットセレクターが目的のコンテナに合う配信を選べた場合は
+            # yt-dlp組み込みのFFmpegMergerが-c copyでマージするだけで済み、
+            # FFmpegVideoConvertorは拡張子一致を検出してスキップする。
+            # セレクター末尾の/bestが別コンテナの単一ファイル（マージ対象外）を
+            # 返したときだけ実際に変換が走り、選択フォーマットどおりの
+            # コンテナで出力されることを保証する
             ydl_opts.update({
                 'format': format_config['format'],
                 'merge_output_format': format_config['merge_output_format'],
                 'postprocessors': [{
                     'key': 'FFmpegVideoConvertor',
-                    'preferedformat': format_config['merge_output_format'],
+                    'preferedformat': video_format,
                 }],
-                'postprocessor_args': format_config['postprocessor_args']
+                'postprocessor_args': list(format_config['postprocessor_args'])
             })
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(url, download=True)
-                print(f"\nダウンロードが完了しました: {info['title']}")
-                return True
-            except yt_dlp.DownloadError as e:
-                print_error("ダウンロード中にエラーが発生しました。", e)
-                if hasattr(e, 'exc_info'):
-                    print(f"例外情報: {e.exc_info}")
-                return False
+        # 閉じずに使い回すためwithブロックにはしない（プロセス終了時に解放される）
+        ydl = _get_ydl(ydl_opts,
+                       (output_path, download_type, video_format, ffmpeg_path))
+        try:
+            info = ydl.extract_info(url, download=True)
+            print(f"\nダウンロードが完了しました: {info['title']}")
+            return True
+        except yt_dlp.DownloadError as e:
+            print_error("ダウンロード中にエラーが発生しました。", e)
+            if hasattr(e, 'exc_info'):
+                print(f"例外情報: {e.exc_info}")
+            return False
+        finally:
+            # 後処理が例外で中断されて'finished'フックが呼ばれなかった場合の保険
+            _release_leaked_pp_slots()
     except Exception as e:
         print_error("予期せぬエラーが発生しました。", e)
         return False
 
 
-def cli_main():
+def cli_main(concurrency=None):
     """
     CLI処理のメイン関数
+    Args:
+        concurrency (int, optional): 同時ダウンロード数。
+            省略時はmin(4, CPUコア数)
     """
+    if not concurrency:
+        concurrency = min(4, os.cpu_count() or 4)
     print(f"動画の保存先: {VIDEO_FILE_PATH}")
     print(f"音声の保存先: {AUDIO_FILE_PATH}")
     ffmpeg_path = detect_ffmpeg()
@@ -302,8 +625,15 @@ def cli_main():
         print("警告: FFmpegが見つかりません。以下のコマンドでインストールしてください:")
         print("brew install ffmpeg")
     while True:
-        url = input("\nYouTube URLを入力してください（終了するにはEnterキーのみ押してください）: ")
-        if not url.strip():
+        print("\nYouTube URLを入力してください（複数入力可。カンマ・空白区切りも可。"
+              "空行で入力を確定、何も入力しなければ終了）")
+        urls = []
+        while True:
+            line = input("URL: ").strip()
+            if not line:
+                break
+            urls.extend(line.replace(',', ' ').split())
+        if not urls:
             break
         print("\n1. 音声のみダウンロード（最高品質opus）")
         print("2. 動画のみダウンロード")
@@ -325,15 +655,41 @@ def cli_main():
             }
             video_format = format_map.get(format_choice, 'mp4')
         if choice == '1':
-            download_video(url, AUDIO_FILE_PATH, 'audio', ffmpeg_path=ffmpeg_path)
+            download_type, output_path = 'audio', AUDIO_FILE_PATH
         elif choice == '2':
-            download_video(url, VIDEO_FILE_PATH, 'video', video_format, ffmpeg_path=ffmpeg_path)
+            download_type, output_path = 'video', VIDEO_FILE_PATH
         elif choice == '3':
-            download_video(url, VIDEO_FILE_PATH, 'both', video_format, ffmpeg_path=ffmpeg_path)
+            download_type, output_path = 'both', VIDEO_FILE_PATH
         else:
             print("無効な選択です。")
+            continue
+        # ダウンロードはネットワーク待ちが支配的なのでスレッドで並列化する
+        # ffmpeg後処理の並列数は_PP_SEMAPHOREで別途制限される
+        max_workers = min(len(urls), concurrency)
+        succeeded = 0
+        failed = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(download_video, url, output_path,
+                                download_type, video_format, ffmpeg_path): url
+                for url in urls
+            }
+            for future in concurrent.futures.as_completed(futures):
+                url = futures[future]
+                if future.result():
+                    succeeded += 1
+                else:
+                    failed += 1
+                    print(f"失敗: {url}")
+        print(f"\n結果: 成功 {succeeded} 件 / 失敗 {failed} 件")
         print("\n-----------------------------------")
 
 
 if __name__ == "__main__":
-    cli_main()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description='YouTube動画・音声ダウンローダー')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='同時ダウンロード数（省略時はmin(4, CPUコア数)）')
+    args = parser.parse_args()
+    cli_main(args.concurrency)
\ No newline at end of file
@@ -16,25 +16,58 @@
 """
 
 import ffmpeg
+import atexit
+import bisect
+import collections
 import signal
+import subprocess
 import sys
+import threading
 from pathlib import Path
 import os
 
-# グローバル変数で現在処理中のファイルを追跡
-current_output_file = None
+try:
+    import fcntl
+except ImportError:  # Windowsにはfcntlがない
+    fcntl = None
+
+# 書き込み途中の一時ファイルを追跡
+# （単一のグローバル変数ではなく集合＋ロックなので並行変換でも安全）
+_inflight_files = set()
+_inflight_lock = threading.Lock()
+
+def _track_temp_file(path):
+    """
+    一時ファイルをクリーンアップ対象として登録
+    """
+    with _inflight_lock:
+        _inflight_files.add(str(path))
+
+def _untrack_temp_file(path):
+    """
+    完了した一時ファイルをクリーンアップ対象から外す
+    """
+    with _inflight_lock:
+        _inflight_files.discard(str(path))
 
 def cleanup_temp_file():
     """
-    一時ファイルを削除する関数
+    書き込み途中の一時ファイルを削除する関数
     """
-    global current_output_file
-    if current_output_file and Path(current_output_file).exists():
-        try:
-            Path(current_output_file).unlink()
-            print(f"\n一時ファイルを削除しました: {current_output_file}")
-        except Exception as e:
-            print(f"一時ファイルの削除中にエラーが発生しました: {e}")
+    with _inflight_lock:
+        pending = list(_inflight_files)
+        _inflight_files.clear()
+    for file_path in pending:
+        path = Path(file_path)
+        if path.exists():
+            try:
+                path.unlink()
+                print(f"\n一時ファイルを削除しました: {file_path}")
+            except Exception as e:
+                print(f"一時ファイルの削除中にエラーが発生しました: {e}")
+
+# 通常終了・クラッシュ時にも書きかけのファイルを残さない
+atexit.register(cleanup_temp_file)
 
 def signal_handler(signum, frame):
     """
@@ -45,6 +78,111 @@ def signal_handler(signum, frame):
     cleanup_temp_file()
     sys.exit(1)
 
+# 高さ（ピクセル）→基準ビットレート（Mbps）の対応表。bisectで引くため
+# 閾値は昇順に並べる。if/elifの連鎖と違い、8Kなどの段を増やすときも
+# 閾値と値を1つずつ足すだけで済む
+_BITRATE_HEIGHTS = (1080, 1440, 2160)
+_BASE_BITRATES = (10, 20, 50, 100)
+
+# -progress pipe:2が出力するkey=value行のキー
+# （進捗表示に使い、エラーログの保持からは除外する）
+_PROGRESS_KEYS = frozenset((
+    b'frame', b'fps', b'bitrate', b'total_size', b'out_time_us', b'out_time_ms',
+    b'out_time', b'dup_frames', b'drop_frames', b'speed', b'progress',
+))
+
+def run_ffmpeg_streaming(stream):
+    """
+    ffmpegコマンドをストリーミング実行する関数
+
+    ffmpeg.run(capture_stderr=True)はstderr全体（長編ではMB単位）を
+    プロセス終了までメモリに溜め込むため、1行ずつ読み捨てて直近の行だけを
+    保持する。動画の長さによらずメモリ使用量は数KBで頭打ちになり、
+    失敗時には末尾のログからエラー内容を確認できる。
+
+    進捗は-statsのフレームごとのテキストではなく、-progressが定期的に
+    出力するkey=value行から拾って表示する（正規表現パース不要で、
+    stderrへの同期書き込みがエンコードを遅くすることもない）。
+
+    Args:
+        stream: ffmpeg-pythonの出力ストリーム
+
+    Raises:
+        ffmpeg.Error: ffmpegが0以外の終了コードで終了した場合
+            （stderr属性に末尾ログを格納）
+    """
+    stream = stream.global_args('-nostats', '-loglevel', 'error',
+                                '-progress', 'pipe:2')
+    cmd = ffmpeg.compile(stream)
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    tail = collections.deque(maxlen=200)
+    progress_shown = False
+    for line in process.stderr:
+        key, sep, value = line.partition(b'=')
+        key = key.strip()
+        if sep and (key in _PROGRESS_KEYS or key.startswith(b'stream_')):
+            if key == b'out_time':
+                print(f"\r進捗: {value.decode(errors='replace').strip()}",
+                      end='', flush=True)
+                progress_shown = True
+            continue
+        tail.append(line)
+    if progress_shown:
+        print()
+    process.stderr.close()
+    returncode = process.wait()
+    if returncode != 0:
+        raise ffmpeg.Error('ffmpeg', None, b''.join(tail))
+
+def x265_thread_params(height):
+    """
+    x265のスレッド関連パラメーターを生成する関数
+
+    x265のデフォルトはコア数の多いCPUで控えめにしか並列化しないため、
+    プールを全コアに広げてWPP（波面並列）を有効にする。frame-threadsは
+    高解像度ほど1フレームあたりのバッファが大きくなるので少なめに抑え、
+    メモリ肥大を防ぎつつ~16コアまでほぼ線形にスケールさせる。
+
+    Args:
+        height (int): 動画の高さ（ピクセル）
+
+    Returns:
+        str: x265-paramsに連結するスレッド設定
+    """
+    cpus = os.cpu_count() or 4
+    if height >= 2160:      # 4K以上
+        frame_threads = min(4, max(2, cpus // 8))
+    elif height >= 1080:    # Full HD
+        frame_threads = min(6, max(2, cpus // 4))
+    else:                   # HD以下
+        frame_threads = min(8, max(2, cpus // 2))
+    return f"pools=+:frame-threads={frame_threads}:wpp=1:pmode=1:pme=1"
+
+def set_output_nocache(path):
+    """
+    出力ファイルにページキャッシュ回避を設定する関数（macOSのみ）
+
+    4K/8Kの大きな出力は一度しか読まれないデータでページキャッシュを
+    埋め尽くし、変換中のフラッシュでメモリ圧迫を招く。F_NOCACHEを
+    設定したファイルを先に作っておくことで、APFS上ではffmpegが開き直した
+    後も書き込みがキャッシュを素通りする。非対応のOSでは何もしない
+    （ベストエフォート）。
+
+    Args:
+        path: 出力ファイルのパス
+    """
+    if fcntl is None or not hasattr(fcntl, 'F_NOCACHE'):
+        return
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.fcntl(fd, fcntl.F_NOCACHE, 1)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
 def get_video_info(input_path):
     """
     入力動画の情報を取得
@@ -54,12 +192,19 @@ def get_video_info(input_path):
         
     Returns:
         dict: 動画情報（コーデック、解像度など）
+
+    Raises:
+        ValueError: 入力に映像ストリームが含まれない場合（音声のみ等）
     """
-    probe = ffmpeg.probe(str(input_path))
-    video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+    probe = ffmpeg.probe(input_path)
+    video_info = next((s for s in probe['streams'] if s['codec_type'] == 'video'),
+                      None)
+    if video_info is None:
+        raise ValueError(f"映像ストリームが見つかりません: {input_path}")
     return video_info
 
-def convert_to_mov(input_path, output_dir=None, preset='veryslow', audio_codec='aac'):
+def convert_to_mov(input_path, output_dir=None, preset='veryslow', audio_codec='aac',
+                   video_info=None):
     """
     動画ファイルをMOV形式に変換する関数
     
@@ -78,33 +223,43 @@ def convert_to_mov(input_path, output_dir=None, preset='veryslow', audio_codec='
         output_dir (str, optional): 出力ディレクトリ。指定がない場合は入力ファイルと同じディレクトリを使用
         preset (str, optional): エンコードプリセット（veryslow, slower, slow, medium, fast, faster, veryfast）
         audio_codec (str, optional): 音声コーデック（aac, copy, mp3, opus）
-    
+        video_info (dict, optional): get_video_info()で取得済みの動画情報。
+            指定するとffprobeの再実行を省略できる（バッチ変換用）
+
     Returns:
         str: 出力されたMOVファイルのパス
     """
-    global current_output_file
-    
+    tmp_path = None
     try:
         input_path = Path(input_path)
         output_dir = Path(output_dir) if output_dir else input_path.parent
         output_dir.mkdir(parents=True, exist_ok=True)
         output_path = output_dir / f"{input_path.stem}.mov"
-        
-        # 出力ファイルパスを記録（クリーンアップ用）
-        current_output_file = str(output_path)
-        
-        # 既存の出力ファイルがある場合は削除
-        if output_path.exists():
-            output_path.unlink()
-        
-        # 入力ファイルの情報を取得
-        probe = ffmpeg.probe(str(input_path))
-        video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+
+        # 同じディレクトリの一時ファイルへ書き出し、成功時にos.replaceで
+        # アトミックに本来の名前へ差し替える（途中でkillされても
+        # 中途半端な.movが残らず、既存出力の上書きも瞬間的に行われる）
+        tmp_path = output_path.with_suffix('.mov.part')
+        _track_temp_file(tmp_path)
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+        # 大容量出力によるページキャッシュ汚染を防ぐ（macOSのみ）
+        set_output_nocache(tmp_path)
+
+
+        # 入力ファイルの情報を取得（probe済みの情報があれば再利用し、
+        # ffprobeの起動を1回で済ませる）
+        if video_info is None:
+            video_info = get_video_info(input_path)
         
         # 解像度の取得
         width = int(video_info.get('width', 1920))
         height = int(video_info.get('height', 1080))
-        fps = float(eval(video_info.get('r_frame_rate', '30/1')))
+        # r_frame_rateは「分子/分母」形式。evalはprobe出力をコードとして
+        # 実行してしまうため、明示的に分数として解釈する
+        num, _, den = video_info.get('r_frame_rate', '30/1').partition('/')
+        fps = float(num) / float(den or 1)
         
         # HDR/カラースペース情報の確認
         is_hdr = False
@@ -130,19 +285,40 @@ def convert_to_mov(input_path, output_dir=None, preset='veryslow', audio_codec='
             print("4K解像度を検出しました")
 
         # 入力設定
-        stream = ffmpeg.input(str(input_path))
+        # ffmpeg-python 0.2.0はファイル名にstrしか受け取れない
+        # （Pathを渡すとoutput()がValueErrorを投げ、compile()の連結も壊れる）
+        # 入力ストリームは別名で保持する。output()済みのOutputStreamは
+        # 再度output()へ渡せないため、CPUフォールバックはここから組み直す
+        in_stream = ffmpeg.input(os.fspath(input_path))
 
         if video_info['codec_name'] == 'prores':
             print("ProResコーデックを直接コピーします")
             print(f"音声コーデック: {audio_codec}")
-            stream = ffmpeg.output(stream, str(output_path),
+            stream = ffmpeg.output(in_stream, os.fspath(tmp_path),
                                  vcodec='copy',
                                  acodec=audio_codec,
                                  audio_bitrate='320k' if audio_codec != 'copy' else None,
                                  format='mov')
+        elif video_info['codec_name'] in ('h264', 'hevc'):
+            # H.264/HEVCはMOVにそのまま格納できるため、再エンコードせず
+            # リマックスのみで済ませる（I/Oバウンドで再エンコードの50〜100倍速い）
+            print(f"{video_info['codec_name']}コーデックを直接コピーします（リマックスのみ）")
+            print(f"音声コーデック: {audio_codec}")
+            output_args = {
+                'vcodec': 'copy',
+                'acodec': audio_codec,
+                'audio_bitrate': '320k' if audio_codec != 'copy' else None,
+                'movflags': '+faststart+empty_moov+delay_moov',
+                'format': 'mov'
+            }
+            if video_info['codec_name'] == 'hevc':
+                output_args['tag:v'] = 'hvc1'  # Appleデバイス互換のタグ
+            # None値を持つキーを削除
+            output_args = {k: v for k, v in output_args.items() if v is not None}
+            stream = ffmpeg.output(in_stream, os.fspath(tmp_path), **output_args)
         else:
-            # ビットレートの計算
-            base_bitrate = 100 if height >= 2160 else 50 if height >= 1440 else 20 if height >= 1080 else 10
+            # ビットレートの計算（解像度の段はモジュール先頭の対応表を参照）
+            base_bitrate = _BASE_BITRATES[bisect.bisect_right(_BITRATE_HEIGHTS, height)]
             bitrate = base_bitrate * (min(fps, 60) / 30)
             maxrate = int(bitrate * 1.5)
             bufsize = int(bitrate * 2)
@@ -164,7 +340,7 @@ def convert_to_mov(input_path, output_dir=None, preset='veryslow', audio_codec='
                     'acodec': audio_codec,
                     'ar': '48000',
                     'audio_bitrate': '320k' if audio_codec != 'copy' else None,
-                    'movflags': '+faststart',
+                    'movflags': '+faststart+empty_moov+delay_moov',
                     'format': 'mov'
                 }
             else:  # macOS環境
@@ -179,7 +355,7 @@ def convert_to_mov(input_path, output_dir=None, preset='veryslow', audio_codec='
                     'acodec': audio_codec,
                     'ar': '48000',
                     'audio_bitrate': '320k' if audio_codec != 'copy' else None,
-                    'movflags': '+faststart',
+                    'movflags': '+faststart+empty_moov+delay_moov',
                     'tag:v': 'hvc1',
                     'format': 'mov'
                 }
@@ -187,13 +363,15 @@ def convert_to_mov(input_path, output_dir=None, preset='veryslow', audio_codec='
             # None値を持つキーを削除
             output_args = {k: v for k, v in output_args.items() if v is not None}
             
-            stream = ffmpeg.output(stream, str(output_path), **output_args)
+            stream = ffmpeg.output(in_stream, os.fspath(tmp_path), **output_args)
         
         stream = ffmpeg.overwrite_output(stream)
         
         try:
             print(f"\n変換開始: {input_path.name} → {output_path.name}")
-            process = ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
+            run_ffmpeg_streaming(stream)
+            os.replace(tmp_path, output_path)  # 同一ファイルシステム上でアトミック
+            _untrack_temp_file(tmp_path)
             print(f"完了: {output_path}")
             return str(output_path)
         except ffmpeg.Error as e:
@@ -210,11 +388,11 @@ def convert_to_mov(input_path, output_dir=None, preset='veryslow', audio_codec='
                 'preset': preset,
                 'profile:v': 'main10',
                 'pix_fmt': 'yuv420p10le' if is_hdr else 'yuv420p',
-                'x265-params': f"aq-mode=3:no-fast-pskip=1:deblock=-1,-1",
+                'x265-params': f"aq-mode=3:no-fast-pskip=1:deblock=-1,-1:{x265_thread_params(height)}",
                 'acodec': audio_codec,
                 'ar': '48000',
                 'audio_bitrate': '320k' if audio_codec != 'copy' else None,
-                'movflags': '+faststart',
+                'movflags': '+faststart+empty_moov+delay_moov',
                 'tag:v': 'hvc1',
                 'format': 'mov',
                 'threads': 'auto'
@@ -222,24 +400,28 @@ def convert_to_mov(input_path, output_dir=None, preset='veryslow', audio_codec='
             
             # HDR/カラースペース情報の保持
             if is_hdr and color_space and color_transfer and color_primaries:
-                x264_params = [
+                x265_params = [
                     "aq-mode=3",
                     "no-fast-pskip=1",
                     "deblock=-1,-1",
+                    x265_thread_params(height),
                     f"colorprim={color_primaries}",
                     f"transfer={color_transfer}",
                     f"colormatrix={color_space}"
                 ]
-                output_args['x265-params'] = ":".join(x264_params)
+                output_args['x265-params'] = ":".join(x265_params)
             
             # None値を持つキーを削除
             output_args = {k: v for k, v in output_args.items() if v is not None}
             
-            stream = ffmpeg.output(stream, str(output_path), **output_args)
+            stream = ffmpeg.output(in_stream, os.fspath(tmp_path), **output_args)
+            stream = ffmpeg.overwrite_output(stream)
             
             try:
                 print(f"\nlibx265による最高品質変換開始: {input_path.name} → {output_path.name}")
-                process = ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
+                run_ffmpeg_streaming(stream)
+                os.replace(tmp_path, output_path)  # 同一ファイルシステム上でアトミック
+                _untrack_temp_file(tmp_path)
                 print(f"完了: {output_path}")
                 return str(output_path)
             except ffmpeg.Error as e:
@@ -253,11 +435,54 @@ def convert_to_mov(input_path, output_dir=None, preset='veryslow', audio_codec='
             raise
         
     except Exception as e:
-        cleanup_temp_file()
+        # 失敗したのはこの変換だけなので、自分のtmp_pathのみ片付ける。
+        # 集合全体のcleanup_temp_file()を呼ぶと、他スレッドが書き込み中の
+        # .partファイルまで削除してしまう（全体の掃除はatexit/シグナルに任せる）
+        if tmp_path is not None:
+            try:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+            except OSError:
+                pass
+            _untrack_temp_file(tmp_path)
         raise e
     
     return str(output_path)
 
+def convert_many_to_mov(input_paths, output_dir=None, preset='veryslow', audio_codec='aac'):
+    """
+    複数の動画ファイルをまとめてMOV形式に変換する関数
+
+    事前に全ファイルをプローブして結果をconvert_to_movへ引き渡すため、
+    ffprobeの起動はファイルごとに1回だけで済む。プローブに失敗した
+    ファイルはスキップし、残りを指定された順に変換する。
+
+    Args:
+        input_paths (list): 入力動画ファイルのパスのリスト
+        output_dir (str, optional): 出力ディレクトリ。指定がない場合は各入力ファイルと同じディレクトリを使用
+        preset (str, optional): エンコードプリセット（veryslow, slower, slow, medium, fast, faster, veryfast）
+        audio_codec (str, optional): 音声コーデック（aac, copy, mp3, opus）
+
+    Returns:
+        list: 出力されたMOVファイルのパスのリスト
+    """
+    probed = []
+    for path in input_paths:
+        try:
+            probed.append((path, get_video_info(path)))
+        except ffmpeg.Error as e:
+            print(f"プローブ失敗のためスキップします: {path}")
+            print(e.stderr.decode() if e.stderr else str(e))
+        except ValueError as e:
+            # 映像ストリームがない（音声のみ・破損など）ファイルはスキップ
+            print(f"プローブ失敗のためスキップします: {path}")
+            print(str(e))
+    output_paths = []
+    for path, info in probed:
+        output_paths.append(
+            convert_to_mov(path, output_dir, preset, audio_codec, video_info=info))
+    return output_paths
+
 # メイン処理
 if __name__ == "__main__":
     import argparse
@@ -268,7 +493,7 @@ if __name__ == "__main__":
     
     # コマンドライン引数の設定
     parser = argparse.ArgumentParser(description='動画をMOV形式に変換')
-    parser.add_argument('input', help='入力ファイルのパス')
+    parser.add_argument('input', nargs='+', help='入力ファイルのパス（複数指定可）')
     parser.add_argument('--output-dir', help='出力ディレクトリ（省略可）')
     parser.add_argument('--preset', default='veryslow', 
                        choices=['veryslow', 'slower', 'slow', 'medium', 'fast', 'faster', 'veryfast'],
@@ -282,8 +507,16 @@ if __name__ == "__main__":
     
     try:
         # 変換の実行と結果の表示
-        output_path = convert_to_mov(args.input, args.output_dir, args.preset, args.audio_codec)
-        print(f"\n保存先: {output_path}")
+        if len(args.input) == 1:
+            output_path = convert_to_mov(args.input[0], args.output_dir,
+                                         args.preset, args.audio_codec)
+            print(f"\n保存先: {output_path}")
+        else:
+            output_paths = convert_many_to_mov(args.input, args.output_dir,
+                                               args.preset, args.audio_codec)
+            print("\n保存先:")
+            for output_path in output_paths:
+                print(f"  {output_path}")
     except KeyboardInterrupt:
         print("\n処理が中断されました")
         cleanup_temp_file()